@@ -17,6 +17,10 @@
 
 import re
 import logging
+import hashlib
+import heapq
+import itertools
+import time
 import ujson as json
 
 from twisted.internet import reactor, defer
@@ -52,7 +56,16 @@ class AntiScamSpamChecker(object):
                                           'hitbtc.com']
         self.settings.update(config)
 
+        # Opt-in capture of checks slower than 'slow_check_threshold_ms'.
+        # A min-heap of (total_ms, seq, entry) holding the slowest
+        # 'slow_check_buffer_size' since the last periodic dump.
+        self.slow_checks = []
+        self.slow_check_seq = itertools.count()
+
         reactor.callWhenRunning(self.update_settings)
+        # always running, since the threshold can be turned on by a
+        # settings update
+        self._schedule_slow_check_dump()
 
     @defer.inlineCallbacks
     def update_settings(self):
@@ -84,18 +97,99 @@ class AntiScamSpamChecker(object):
         if not hasattr(event, "content") or "body" not in event.content:
             return False
 
-        if self.isAdmin(event.sender) or self.isMod(event.sender) or self.isBot(event.sender):
+        if self.settings.get('slow_check_threshold_ms') is None:
+            return self._check_event_for_spam(event, None)
+
+        timings = []
+        result = self._check_event_for_spam(event, timings)
+        self._record_slow_check(event, timings)
+        return result
+
+    def _check_event_for_spam(self, event, timings):
+        if self._timed(timings, 'sender_exemption', self.isExempt, event.sender):
             return False
 
-        bad_domains = self.badURLDomains(event)
+        bad_domains = self._timed(timings, 'badURLDomains', self.badURLDomains, event)
 
-        if self.isETH_BTC(event):
+        if self._timed(timings, 'isETH_BTC', self.isETH_BTC, event):
             return "Wallet addresses are not permitted"
         elif bad_domains:
             return "Message contains links to prohibited domains: %s" % (','.join(bad_domains),)
 
         return False
 
+    @staticmethod
+    def _timed(timings, stage, f, arg):
+        if timings is None:
+            return f(arg)
+        start = time.time()
+        try:
+            return f(arg)
+        finally:
+            timings.append((stage, (time.time() - start) * 1000))
+
+    def _record_slow_check(self, event, timings):
+        total_ms = sum(ms for _, ms in timings)
+        if total_ms < self.settings['slow_check_threshold_ms']:
+            return
+
+        # the body is whatever the client sent and exempt senders never
+        # have it checked, so don't assume it's a string here
+        body = event.content['body']
+        body_length = None
+        body_hash = '<%s>' % (type(body).__name__,)
+        if isinstance(body, basestring):
+            if isinstance(body, unicode):
+                body = body.encode('utf8')
+            body_length = len(body)
+            # enough to match up repeat offenders without keeping the text
+            body_hash = hashlib.sha256(body).hexdigest()[:16]
+
+        entry = {
+            'event_id': event.event_id,
+            'body_length': body_length,
+            'body_hash': body_hash,
+            'total_ms': total_ms,
+            'stages': dict(timings),
+        }
+        logger.debug("Slow spam check: %r", entry)
+
+        item = (total_ms, next(self.slow_check_seq), entry)
+        if len(self.slow_checks) < self.settings.get('slow_check_buffer_size', 50):
+            heapq.heappush(self.slow_checks, item)
+        else:
+            # drops whichever is quickest, which may be the new one
+            heapq.heappushpop(self.slow_checks, item)
+
+    def dump_slow_checks(self):
+        'Log the captured slow checks, slowest first'
+        if not self.slow_checks:
+            logger.debug("No slow spam checks captured")
+            return
+
+        entries = [e for _, _, e in sorted(self.slow_checks, reverse=True)]
+        logger.info("%d slow spam checks captured:", len(entries))
+        for e in entries:
+            logger.info(
+                "%s: %.1fms (%s) body length %s, hash %s",
+                e['event_id'], e['total_ms'],
+                ', '.join('%s %.1fms' % (stage, ms) for stage, ms in sorted(e['stages'].items())),
+                e['body_length'], e['body_hash'],
+            )
+
+    def _schedule_slow_check_dump(self):
+        # read on every tick so settings updates take effect
+        interval = self.settings.get('slow_check_dump_interval') or 300
+        reactor.callLater(interval, self.periodic_dump_slow_checks)
+
+    def periodic_dump_slow_checks(self):
+        try:
+            self.dump_slow_checks()
+            # each dump covers the worst checks since the previous one
+            self.slow_checks = []
+        finally:
+            self._schedule_slow_check_dump()
+
     def user_may_invite(self, inviter_userid, invitee_userid, roomid):
         return (
             self.isAdmin(inviter_userid) or
@@ -116,6 +210,9 @@ class AntiScamSpamChecker(object):
     def user_may_publish_room(self, userid, room_alias):
         return self.isAdmin(userid) or self.isMod(userid) or self.isBot(userid)
 
+    def isExempt(self, userid):
+        return self.isAdmin(userid) or self.isMod(userid) or self.isBot(userid)
+
     def isAdmin(self, userid):
         if 'admins' not in self.settings:
             logger.warn("No admins in config file")
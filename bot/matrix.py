@@ -94,10 +94,10 @@ class MatrixClient(object):
     def sync(self):
         url = self.base_url + '_matrix/client/r0/sync'
         if self.next_batch is not None:
-            print("syncing")
+            logger.debug("syncing")
             url += '?since='+self.next_batch+'&timeout=30000'
         else:
-            print("initial syncing")
+            logger.debug("initial syncing")
             url += '?filter=' + json.dumps({
                 'room': {
                     'timeline': {
@@ -109,7 +109,7 @@ class MatrixClient(object):
         req = grequests.get(url)
         req.send()
         if self.next_batch is None:
-            print("done!")
+            logger.debug("done!")
 
         if req.response is None:
             raise Exception("sync request failed: response was None")
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017, 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Drive the bot against a local stub homeserver and report how it keeps up.
+
+The real MatrixClient and BotHandler are run unmodified apart from some
+timing wrappers. Traffic is either generated (a batch of invites for every
+room followed by chatter and moderator commands) or replayed from a file of
+recorded sync responses, one JSON object per line.
+
+The stub homeserver runs in a child process, so the memory and CPU figures
+belong to the bot alone. Settings are read from and saved to a scratch
+directory so the bot's real settings.yaml is never touched.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import yaml
+
+import gevent
+
+from bot.handler import BotHandler
+from bot.matrix import MatrixClient
+import bot.settings
+from stubserver import ADMIN, MODS, serve
+
+HAVE_PROCFS = os.path.exists('/proc/self/statm')
+
+
+class Stats(object):
+    def __init__(self):
+        self.commands = 0
+        self.command_times = []
+        self.send_latencies = []
+        self.send_failures = 0
+        self.sync_lags = []
+        self.aborted_batches = 0
+        self.sync_failures = 0
+        self.memory = []
+
+
+class LoadTestClient(MatrixClient):
+    def __init__(self, base_url, access_token, stats):
+        super(LoadTestClient, self).__init__(base_url, access_token)
+        self.stats = stats
+
+    def send_event(self, roomid, event_type, ev):
+        start = time.time()
+        try:
+            return super(LoadTestClient, self).send_event(roomid, event_type, ev)
+        except Exception:
+            self.stats.send_failures += 1
+            raise
+        finally:
+            self.stats.send_latencies.append(time.time() - start)
+
+    def sync(self):
+        try:
+            return super(LoadTestClient, self).sync()
+        except Exception:
+            self.stats.sync_failures += 1
+            raise
+
+    def process_sync(self, sync):
+        try:
+            super(LoadTestClient, self).process_sync(sync)
+        except Exception:
+            # MatrixClient.run gives up on the rest of the batch
+            if 'loadtest_queued_at' in sync:
+                self.stats.aborted_batches += 1
+            raise
+        finally:
+            if 'loadtest_queued_at' in sync:
+                self.stats.sync_lags.append(time.time() - sync['loadtest_queued_at'])
+
+
+class LoadTestHandler(BotHandler):
+    def __init__(self, cli, stats):
+        super(LoadTestHandler, self).__init__(cli)
+        self.stats = stats
+
+    def process_command(self, roomid, userid, cmd):
+        start = time.time()
+        try:
+            super(LoadTestHandler, self).process_command(roomid, userid, cmd)
+        finally:
+            self.stats.commands += 1
+            self.stats.command_times.append(time.time() - start)
+
+
+def rss_kb():
+    """Current RSS, or the peak so far if there's no procfs to ask."""
+    if HAVE_PROCFS:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on macOS, KiB everywhere else
+        peak /= 1024
+    return peak
+
+
+def sample_memory(stats, start, interval):
+    while True:
+        stats.memory.append((time.time() - start, rss_kb()))
+        gevent.sleep(interval)
+
+
+def wait_for_port(stub, port, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return
+        except socket.error:
+            if not stub.is_alive() or time.time() > deadline:
+                raise
+            gevent.sleep(0.05)
+
+
+def percentiles(values):
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+    pick = lambda p: values[min(int(len(values) * p), len(values) - 1)] * 1000
+    return 'p50 %.1fms p95 %.1fms p99 %.1fms max %.1fms' % (
+        pick(0.5), pick(0.95), pick(0.99), values[-1] * 1000,
+    )
+
+
+def report(stats, server_stats, elapsed):
+    print("duration: %.1fs" % (elapsed,))
+    if server_stats is not None:
+        print("rooms joined: %d" % (server_stats['rooms_joined'],))
+    print("commands processed: %d (%.1f/s)" % (stats.commands, stats.commands / elapsed))
+    print("command handling: %s" % (percentiles(stats.command_times),))
+    print("notices sent: %d, failed: %d" % (len(stats.send_latencies) - stats.send_failures, stats.send_failures))
+    print("notice send latency: %s" % (percentiles(stats.send_latencies),))
+    # aborted batches were delivered but cut short by a failed request;
+    # their lag still counts
+    delivered = len(stats.sync_lags)
+    print("sync batches processed: %d, aborted: %d, sync failures: %d" % (
+        delivered - stats.aborted_batches, stats.aborted_batches, stats.sync_failures,
+    ))
+    print("sync lag (including aborted batches): %s" % (percentiles(stats.sync_lags),))
+    if server_stats is not None:
+        print("sync batches never delivered: %d" % (server_stats['batches_queued'] - delivered,))
+        print("server requests: %s" % (', '.join(
+            '%s=%d' % (k, v) for k, v in sorted(server_stats['counts'].items())
+        ),))
+    if HAVE_PROCFS:
+        print("bot memory (rss):")
+    else:
+        print("bot memory (peak rss so far, no /proc to read current rss from):")
+    for t, kb in stats.memory:
+        print("  %7.1fs %8d KiB" % (t, kb))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=18008)
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--events-per-batch', type=int, default=50)
+    parser.add_argument('--command-ratio', type=float, default=0.2,
+                        help="fraction of synthetic events that are bot commands")
+    parser.add_argument('--batch-interval', type=float, default=0,
+                        help="seconds between queueing sync batches; 0 queues them all at once")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="replay recorded sync responses instead of synthetic traffic")
+    parser.add_argument('--record', metavar='FILE',
+                        help="write the traffic that was sent to FILE for later replay")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="seconds added to every request")
+    parser.add_argument('--latency-jitter', type=float, default=0,
+                        help="up to this many extra seconds added at random")
+    parser.add_argument('--ratelimit-rate', type=float, default=0,
+                        help="fraction of requests answered with a 429")
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help="fraction of requests answered with a 500")
+    parser.add_argument('--memory-interval', type=float, default=1)
+    parser.add_argument('--timeout', type=float, default=600,
+                        help="give up after this many seconds")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.replay:
+        args.replay = os.path.abspath(args.replay)
+    if args.record:
+        args.record = os.path.abspath(args.record)
+
+    workdir = tempfile.mkdtemp(prefix='antiscam-loadtest-')
+    os.chdir(workdir)
+    with open('settings.yaml', 'w') as f:
+        f.write(yaml.dump({
+            'admins': [ADMIN],
+            'mods': MODS,
+            'url_whitelist': ['github.com'],
+        }))
+    bot.settings.load()
+
+    conn, child_conn = multiprocessing.Pipe()
+    stub = multiprocessing.Process(target=serve, args=(child_conn, args))
+    stub.start()
+    # otherwise our copy keeps the pipe open if the stub dies
+    child_conn.close()
+
+    try:
+        wait_for_port(stub, args.port, 10)
+
+        stats = Stats()
+        cli = LoadTestClient('http://localhost:%d/' % (args.port,), 'loadtest', stats)
+        cli.handler = LoadTestHandler(cli, stats)
+
+        start = time.time()
+        memory_greenlet = gevent.spawn(sample_memory, stats, start, args.memory_interval)
+        cli_greenlet = gevent.spawn(cli.run)
+
+        # the stub reports back once the bot has drained all the traffic
+        while not conn.poll() and stub.is_alive() and time.time() - start < args.timeout:
+            gevent.sleep(0.1)
+        if not conn.poll() and stub.is_alive():
+            print("timed out after %ds, reporting what we have" % (args.timeout,))
+            conn.send('stop')
+        elapsed = time.time() - start
+
+        gevent.killall([cli_greenlet, memory_greenlet])
+        stats.memory.append((elapsed, rss_kb()))
+
+        server_stats = None
+        if conn.poll(5):
+            try:
+                server_stats = conn.recv()
+            except EOFError:
+                pass
+        if server_stats is None:
+            print("stub homeserver did not report back (exit code %r)" % (stub.exitcode,))
+    finally:
+        if stub.is_alive():
+            stub.terminate()
+        stub.join()
+        shutil.rmtree(workdir)
+
+    report(stats, server_stats, elapsed)
+
+
+if __name__ == '__main__':
+    main()
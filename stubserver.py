@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017, 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A fake homeserver for load testing the bot.
+
+Implements just enough of the client-server API for MatrixClient: /sync,
+/send, /join, /filter and /messages. Sync batches are queued with
+enqueue_batch() and handed out one per /sync request. Every request can be
+delayed, rate limited or failed at random to see how the bot copes.
+
+loadtest.py runs this in a child process via serve(), which also generates
+or replays the traffic, so none of the stub's memory or CPU is counted
+against the bot.
+"""
+
+import collections
+import random
+import time
+import ujson as json
+
+from flask import Flask, Response, request
+from gevent.pywsgi import WSGIServer
+import gevent
+import gevent.event
+
+ADMIN = '@admin:loadtest'
+MODS = ['@mod%d:loadtest' % (i,) for i in xrange(5)]
+
+# events kept per room for /messages
+TIMELINE_LIMIT = 100
+
+
+class StubHomeserver(object):
+    def __init__(self, latency=0, latency_jitter=0, ratelimit_rate=0,
+                 error_rate=0, retry_after_ms=500):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.ratelimit_rate = ratelimit_rate
+        self.error_rate = error_rate
+        self.retry_after_ms = retry_after_ms
+
+        self.sync_queue = collections.deque()
+        self.batches_queued = 0
+        self.pending_echo = collections.defaultdict(list)
+        self.wakeup = gevent.event.Event()
+        # set while a /sync is parked with nothing left to hand out
+        self.idle = gevent.event.Event()
+        self.next_token = 0
+
+        self.timelines = collections.defaultdict(
+            lambda: collections.deque(maxlen=TIMELINE_LIMIT),
+        )
+        self.joined = set()
+        self.filters = {}
+        self.next_event_id = 0
+
+        self.counts = collections.Counter()
+
+        self.app = self._make_app()
+
+    def enqueue_batch(self, rooms):
+        """Queue the 'rooms' section of a sync response for delivery."""
+        self.next_token += 1
+        token = 's%d' % (self.next_token,)
+        self.sync_queue.append((token, rooms, time.time()))
+        self.batches_queued += 1
+        self.idle.clear()
+        self.wakeup.set()
+        return token
+
+    def make_event_id(self):
+        self.next_event_id += 1
+        return '$%d:loadtest' % (self.next_event_id,)
+
+    def _inject_faults(self, endpoint):
+        self.counts[endpoint] += 1
+        delay = self.latency
+        if self.latency_jitter:
+            delay += random.uniform(0, self.latency_jitter)
+        if delay:
+            gevent.sleep(delay)
+
+        roll = random.random()
+        if roll < self.ratelimit_rate:
+            self.counts[endpoint + ' 429'] += 1
+            return self._error(429, 'M_LIMIT_EXCEEDED', 'Too many requests', {
+                'retry_after_ms': self.retry_after_ms,
+            })
+        elif roll < self.ratelimit_rate + self.error_rate:
+            self.counts[endpoint + ' 500'] += 1
+            return self._error(500, 'M_UNKNOWN', 'Internal server error')
+        return None
+
+    @staticmethod
+    def _json(body, code=200):
+        return Response(json.dumps(body), status=code, mimetype='application/json')
+
+    def _error(self, code, errcode, error, extra=None):
+        body = {'errcode': errcode, 'error': error}
+        if extra:
+            body.update(extra)
+        return self._json(body, code)
+
+    def drained(self):
+        return not self.sync_queue and not self.pending_echo and self.idle.is_set()
+
+    def _take_batch(self, since):
+        rooms = {'join': {}, 'invite': {}, 'leave': {}}
+        token = since
+        queued_at = None
+        if self.sync_queue:
+            token, queued, queued_at = self.sync_queue.popleft()
+            for section in ('join', 'invite', 'leave'):
+                rooms[section].update(queued.get(section, {}))
+        elif self.pending_echo:
+            self.next_token += 1
+            token = 's%d' % (self.next_token,)
+
+        # the bot sees its own messages come back down the sync stream
+        for roomid, events in self.pending_echo.items():
+            room = rooms['join'].setdefault(roomid, {'timeline': {'events': []}})
+            room['timeline']['events'].extend(events)
+        self.pending_echo.clear()
+
+        for roomid, room in rooms['join'].items():
+            self.timelines[roomid].extend(room['timeline']['events'])
+
+        if not self.sync_queue:
+            self.wakeup.clear()
+        return token, rooms, queued_at
+
+    def _make_app(self):
+        app = Flask(__name__)
+
+        @app.route('/_matrix/client/r0/sync')
+        def sync():
+            err = self._inject_faults('sync')
+            if err is not None:
+                return err
+
+            since = request.args.get('since')
+            if since is None:
+                # the bot asks for an initial sync with no timeline, so just
+                # hand back a position in the stream
+                return self._json({
+                    'next_batch': 's0',
+                    'rooms': {'join': {}, 'invite': {}, 'leave': {}},
+                })
+
+            if not self.sync_queue and not self.pending_echo:
+                timeout = int(request.args.get('timeout', 0)) / 1000.0
+                self.idle.set()
+                self.wakeup.wait(timeout)
+
+            token, rooms, queued_at = self._take_batch(since)
+            body = {'next_batch': token, 'rooms': rooms}
+            if queued_at is not None:
+                # lets the harness work out sync lag from its side of the pipe
+                body['loadtest_queued_at'] = queued_at
+            return self._json(body)
+
+        @app.route('/_matrix/client/r0/rooms/<roomid>/send/<event_type>/<txnid>', methods=['PUT'])
+        def send(roomid, event_type, txnid):
+            err = self._inject_faults('send')
+            if err is not None:
+                return err
+
+            event_id = self.make_event_id()
+            ev = {
+                'event_id': event_id,
+                'type': event_type,
+                'sender': '@bot:loadtest',
+                'origin_server_ts': int(time.time() * 1000),
+                'content': request.get_json(force=True),
+            }
+            self.pending_echo[roomid].append(ev)
+            self.wakeup.set()
+            return self._json({'event_id': event_id})
+
+        @app.route('/_matrix/client/r0/join/<roomid>', methods=['POST'])
+        def join(roomid):
+            err = self._inject_faults('join')
+            if err is not None:
+                return err
+
+            self.joined.add(roomid)
+            return self._json({'room_id': roomid})
+
+        @app.route('/_matrix/client/r0/user/<userid>/filter', methods=['POST'])
+        def create_filter(userid):
+            err = self._inject_faults('filter')
+            if err is not None:
+                return err
+
+            filter_id = str(len(self.filters))
+            self.filters[filter_id] = request.get_json(force=True)
+            return self._json({'filter_id': filter_id})
+
+        @app.route('/_matrix/client/r0/user/<userid>/filter/<filter_id>')
+        def get_filter(userid, filter_id):
+            err = self._inject_faults('filter')
+            if err is not None:
+                return err
+
+            if filter_id not in self.filters:
+                return self._error(404, 'M_NOT_FOUND', 'No such filter')
+            return self._json(self.filters[filter_id])
+
+        @app.route('/_matrix/client/r0/rooms/<roomid>/messages')
+        def messages(roomid):
+            err = self._inject_faults('messages')
+            if err is not None:
+                return err
+
+            timeline = list(self.timelines.get(roomid, []))
+            limit = int(request.args.get('limit', 10))
+            # tokens are plain offsets into what's left of the room's timeline
+            start = int(request.args.get('from', len(timeline)))
+            if request.args.get('dir', 'b') == 'b':
+                end = max(start - limit, 0)
+                chunk = list(reversed(timeline[end:start]))
+            else:
+                end = min(start + limit, len(timeline))
+                chunk = timeline[start:end]
+            return self._json({
+                'start': str(start),
+                'end': str(end),
+                'chunk': chunk,
+            })
+
+        return app
+
+
+def make_message(server, sender, body):
+    return {
+        'event_id': server.make_event_id(),
+        'type': 'm.room.message',
+        'sender': sender,
+        'origin_server_ts': int(time.time() * 1000),
+        'content': {
+            'msgtype': 'm.text',
+            'body': body,
+        },
+    }
+
+
+def synthetic_batches(server, args):
+    rooms = ['!room%d:loadtest' % (i,) for i in xrange(args.rooms)]
+    yield {
+        'invite': dict((roomid, {'invite_state': {'events': []}}) for roomid in rooms),
+    }
+
+    domain = 0
+    for _ in xrange(args.batches):
+        join = {}
+        for _ in xrange(args.events_per_batch):
+            roomid = random.choice(rooms)
+            events = join.setdefault(roomid, {'timeline': {'events': []}})['timeline']['events']
+            if random.random() < args.command_ratio:
+                mod = random.choice(MODS)
+                cmd = random.choice(['$url list', '$mods list', '$url add'])
+                if cmd == '$mods list':
+                    # only admins may manage mods
+                    events.append(make_message(server, ADMIN, cmd))
+                elif cmd == '$url add':
+                    # keep the whitelist from growing without bound
+                    domain += 1
+                    events.append(make_message(server, mod, '$url add loadtest%d.example' % (domain,)))
+                    events.append(make_message(server, mod, '$url remove loadtest%d.example' % (domain,)))
+                else:
+                    events.append(make_message(server, mod, cmd))
+            else:
+                user = '@user%d:loadtest' % (random.randint(0, 10 * args.rooms),)
+                events.append(make_message(server, user, 'hello from %s' % (user,)))
+        yield {'join': join}
+
+
+def recorded_batches(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            batch = json.loads(line)
+            # accept either whole sync responses or just their 'rooms' section
+            yield batch.get('rooms', batch)
+
+
+def feed(server, batches, interval, record):
+    for rooms in batches:
+        if record is not None:
+            record.write(json.dumps({'rooms': rooms}) + '\n')
+        server.enqueue_batch(rooms)
+        if interval:
+            gevent.sleep(interval)
+        else:
+            # still let the server get a look in
+            gevent.sleep(0)
+
+
+def serve(conn, args):
+    """Child process entry point.
+
+    Runs the stub and feeds it traffic until the bot has drained everything,
+    or until anything arrives on conn, then sends back the stub's counters.
+    """
+    # open this first so a bad path fails before we start listening
+    record = open(args.record, 'w') if args.record else None
+
+    server = StubHomeserver(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        ratelimit_rate=args.ratelimit_rate,
+        error_rate=args.error_rate,
+    )
+    http_server = WSGIServer(('localhost', args.port), server.app, log=None)
+    http_server.start()
+
+    if args.replay:
+        batches = recorded_batches(args.replay)
+    else:
+        batches = synthetic_batches(server, args)
+    feed_greenlet = gevent.spawn(feed, server, batches, args.batch_interval, record)
+
+    while not conn.poll():
+        if feed_greenlet.ready() and server.drained():
+            break
+        gevent.sleep(0.1)
+
+    http_server.stop()
+    if record is not None:
+        record.close()
+    conn.send({
+        'batches_queued': server.batches_queued,
+        'rooms_joined': len(server.joined),
+        'counts': dict(server.counts),
+    })